@@ -1,13 +1,15 @@
 import sys
 
 import os
+import time
 from utils import *
+from warmup import OllamaWarmer, is_ollama_config
+from router import LatencyRouter
 
 # 延迟加载大模块
 def _lazy_imports():
-    global OpenAI, get_tokenize, ThreadPoolExecutor
+    global OpenAI, ThreadPoolExecutor
     from openai import OpenAI
-    from tknz.deepseek_tokenizer import get_tokenize
     from concurrent.futures import ThreadPoolExecutor
 
 
@@ -23,6 +25,16 @@ class ConfigManager:
     • tknz_path: 分词器资源路径
     • HISTORY_FILE: 对话历史存储路径
     • model_settings_dir: 模型配置目录 (环境变量: MODEL_SETTINGS_DIR)
+    • OLLAMA_KEEP_ALIVE: 本地模型保活时长 (环境变量: OLLAMA_KEEP_ALIVE)
+    • OLLAMA_PING_INTERVAL: 保活请求间隔秒数 (环境变量: OLLAMA_PING_INTERVAL)
+    • OLLAMA_IDLE_TIMEOUT: 会话空闲多久后停止保活 (环境变量: OLLAMA_IDLE_TIMEOUT)
+    • LATENCY_FILE: 冷/热启动延迟统计路径
+    • PAYLOAD_MINIMIZE: 是否在请求前压缩历史消息 (环境变量: PAYLOAD_MINIMIZE)
+    • PAYLOAD_KEEP_RECENT: 原样保留的最近消息条数 (环境变量: PAYLOAD_KEEP_RECENT)
+    • ROUTER_PROBE_INTERVAL: 端点健康探测间隔秒数 (环境变量: ROUTER_PROBE_INTERVAL)
+    • ROUTER_ERROR_THRESHOLD: 判定端点劣化的错误率阈值 (环境变量: ROUTER_ERROR_THRESHOLD)
+    • TOKEN_COUNT_MODE: token计数方式 estimate/exact (环境变量: TOKEN_COUNT_MODE)
+    • HISTORY_DEBOUNCE: 对话历史写盘的防抖间隔秒数 (环境变量: HISTORY_DEBOUNCE)
     使用示例：
     >>> config = ConfigManager()
     >>> print(config.HISTORY_FILE)
@@ -37,9 +49,36 @@ class ConfigManager:
         self.HISTORY_FILE = os.path.join(self.CONFIG_DIR, 'conversation_history.json')
         # 获取环境变量MODEL_SETTINGS_DIR的值，如果没有设置，则默认为modelSettings
         self.model_settings_dir = os.getenv('MODEL_SETTINGS_DIR', 'modelSettings')
+        # 本地Ollama模型预热与保活参数
+        self.OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '5m')
+        self.OLLAMA_PING_INTERVAL = float(os.getenv('OLLAMA_PING_INTERVAL', '120'))
+        self.OLLAMA_IDLE_TIMEOUT = float(os.getenv('OLLAMA_IDLE_TIMEOUT', '600'))
+        self.LATENCY_FILE = os.path.join(self.CONFIG_DIR, 'latency_stats.jsonl')
+        # 请求上下文压缩参数
+        self.PAYLOAD_MINIMIZE = os.getenv('PAYLOAD_MINIMIZE', '1') != '0'
+        self.PAYLOAD_KEEP_RECENT = int(os.getenv('PAYLOAD_KEEP_RECENT', '4'))
+        # 端点路由参数
+        self.ROUTER_PROBE_INTERVAL = float(os.getenv('ROUTER_PROBE_INTERVAL', '60'))
+        self.ROUTER_ERROR_THRESHOLD = float(os.getenv('ROUTER_ERROR_THRESHOLD', '0.5'))
+        # 默认使用轻量估算器，exact 时才加载transformers分词器
+        self.TOKEN_COUNT_MODE = os.getenv('TOKEN_COUNT_MODE', 'estimate')
+        self.HISTORY_DEBOUNCE = float(os.getenv('HISTORY_DEBOUNCE', '1.0'))
 
 config = ConfigManager()
 _CONFIG_CACHE = {'files': None, 'mtime': 0}
+# 端点路由器，由 start_router() 在启动时创建
+router = None
+
+
+def start_router():
+    """创建并在后台启动端点路由器，立即返回，不阻塞交互菜单"""
+    global router
+    if router is None:
+        router = LatencyRouter(search_files(config.model_settings_dir),
+                               probe_interval=config.ROUTER_PROBE_INTERVAL,
+                               error_threshold=config.ROUTER_ERROR_THRESHOLD)
+    router.start()
+    return router
 
 def selected_file() -> str:
     """
@@ -48,13 +87,21 @@ def selected_file() -> str:
     优化点:
     • 缓存文件列表和最后修改时间
     • 仅当目录变更时重新扫描
+    • 路由器可用时提供"自动选择"，按分组挑选最快的健康端点（规则见 LatencyRouter.fastest）
     """
     current_mtime = os.path.getmtime(config.model_settings_dir)
     if not _CONFIG_CACHE['files'] or current_mtime > _CONFIG_CACHE['mtime']:
         _CONFIG_CACHE['files'] = search_files(config.model_settings_dir)
         _CONFIG_CACHE['mtime'] = current_mtime
     
-    selected_file = ask_user_choice(_CONFIG_CACHE['files'])
+    selected_file = ask_user_choice(_CONFIG_CACHE['files'], allow_auto=router is not None)
+    while selected_file == AUTO_CHOICE:
+        group = q_input("请输入分组（local/api，留空不限）: ").strip() or None
+        selected_file = router.fastest(group)
+        if selected_file is None:
+            cprint("暂无可用的健康端点，请手动选择", 'warning')
+            cprint(router.summary(), 'system')
+            selected_file = ask_user_choice(_CONFIG_CACHE['files'], allow_auto=True)
     cprint(f"你选择的文件是:{os.path.basename(selected_file)}", 'prompt')
     return selected_file
 
@@ -92,49 +139,134 @@ def init_config():
         os.makedirs(config.CONFIG_DIR)
 
 
+# token计数显示
+def token_count_text(text: str) -> str:
+    """按配置返回token计数的显示文本：默认估算，exact 模式使用真实分词器"""
+    if config.TOKEN_COUNT_MODE == 'exact':
+        from tknz.deepseek_tokenizer import count_tokens as exact_count
+        return f"{exact_count(text, config.tknz_path)} tokens"
+    return f"≈{estimate_tokens(text)} tokens"
+
+
 # 保存对话上下文
-from threading import Lock
-import queue
+import atexit
+import tempfile
+from threading import Condition, Lock, Thread
 
 history_cache = {}
 file_lock = Lock()
-log_queue = queue.Queue()
 
-def async_writer():
-    while True:
-        item = log_queue.get()
-        if item is None:
-            break
-        preset, ctx = item
-        with file_lock:
-            with open(config.HISTORY_FILE, 'w', encoding='utf-8') as f:
-                json.dump({"preset": preset, "history": ctx}, f, ensure_ascii=False, indent=2)
 
-from threading import Thread
-writer_thread = Thread(target=async_writer, daemon=True)
-writer_thread.start()
+def copy_history(context):
+    """复制消息列表及每条消息，使调用方与缓存、写入线程互不共享可变对象"""
+    return [dict(m) for m in list(context)]
+
+
+class HistoryWriter:
+    """
+    合并、防抖的对话历史写入器
+    功能：
+    - 多次保存请求只保留最新快照，旧的未写入快照直接丢弃
+    - 最近一次请求后等待 debounce 秒再写入，合并连续保存
+    - 写临时文件后 os.replace 原子替换，读者或崩溃不会看到截断文件
+    - 程序退出时同步写出尚未落盘的快照
+    统计：requested 为保存请求次数，written 为实际写盘次数；保存提示与程序退出时输出
+    """
+    def __init__(self, path: str, debounce: float = 1.0):
+        self.path = path
+        self.debounce = debounce
+        self.requested = 0
+        self.written = 0
+        self._pending = None
+        self._last_request = 0.0
+        self._cond = Condition()
+        # mkstemp 创建的临时文件权限为0600，替换前恢复为原文件或umask默认的权限
+        umask = os.umask(0)
+        os.umask(umask)
+        self._default_mode = 0o666 & ~umask
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, preset, context):
+        """提交快照：复制消息列表与每条消息，之后对原列表的修改不影响写入内容；快照仅供写入线程使用"""
+        snapshot = {"preset": preset, "history": copy_history(context)}
+        with self._cond:
+            self._pending = snapshot
+            self.requested += 1
+            self._last_request = time.monotonic()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                # 防抖：距最近一次请求不足 debounce 秒则继续等待
+                remaining = self._last_request + self.debounce - time.monotonic()
+                while remaining > 0 and self._pending is not None:
+                    self._cond.wait(remaining)
+                    remaining = self._last_request + self.debounce - time.monotonic()
+            self.flush()
+
+    def stats_text(self) -> str:
+        """保存请求次数与实际写盘次数，用于观察合并效果"""
+        return f"保存请求 {self.requested} 次，实际写盘 {self.written} 次"
+
+    def close(self):
+        """退出时写出待写快照并报告统计"""
+        self.flush()
+        if self.requested:
+            cprint(f"对话历史: {self.stats_text()}", 'system')
+
+    def flush(self):
+        """立即写出最新的待写快照（无待写内容时直接返回）"""
+        with file_lock:
+            with self._cond:
+                snapshot, self._pending = self._pending, None
+            if snapshot is None:
+                return
+            directory = os.path.dirname(self.path) or '.'
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.history-', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f, ensure_ascii=False, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                try:
+                    mode = os.stat(self.path).st_mode & 0o777
+                except FileNotFoundError:
+                    mode = self._default_mode
+                os.chmod(tmp_path, mode)
+                os.replace(tmp_path, self.path)
+                self.written += 1
+            except OSError as e:
+                cprint(f"保存历史记录失败: {str(e)}", 'warning')
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+
+history_writer = HistoryWriter(config.HISTORY_FILE, config.HISTORY_DEBOUNCE)
+atexit.register(history_writer.close)
 
 def save_history(preset_name, context):
     init_config()
     global history_cache
-    history_cache = {'preset': preset_name, 'history': context}
-    try:
-        log_queue.put((preset_name, context))
-    except Exception as e:
-        cprint(f"保存历史记录失败: {str(e)}",'warning')
+    history_writer.submit(preset_name, context)
+    history_cache = {'preset': preset_name, 'history': copy_history(context)}
 
 
 # 加载历史记录
 def load_history():
     global history_cache
+    # 返回副本：恢复对话时会修改并追加消息，不能改动缓存本身
     if history_cache:
-        return history_cache.get('preset'), history_cache.get('history')
+        return history_cache.get('preset'), copy_history(history_cache.get('history') or [])
     try:
         if os.path.exists(config.HISTORY_FILE):
             with open(config.HISTORY_FILE, 'r', encoding='utf-8') as f:
                 data = json.load(f)
                 history_cache.update(data)
-                return data['preset'], data['history']
+                return data['preset'], copy_history(data['history'])
     except Exception as e:
         cprint(f"加载历史记录失败: {str(e)}",'warning')
     return None, None
@@ -153,23 +285,44 @@ def check_system_readiness():
 # 缓存模型配置
 _MODEL_CACHE = {}
 
+def load_model_settings(msd: str) -> ModelSettings:
+    """读取配置文件并创建模型设置（带缓存）"""
+    # 如果选择的文件不在缓存中，则读取配置文件并创建模型设置
+    if msd not in _MODEL_CACHE:
+        # 读取msd路径下的json配置文件
+        config_data = read_json_config(msd)
+        # 将模型设置缓存到_MODEL_CACHE字典中，键为msd，值为ModelSettings对象，参数为config_data字典中的model、api_key和url
+        _MODEL_CACHE[msd] = ModelSettings(config_data['model'], config_data['api_key'], config_data['url'])
+    return _MODEL_CACHE[msd]
+
+
+def start_warmer(msd: str, ums: ModelSettings):
+    """本地Ollama模型：后台预热并保活，其他配置返回None"""
+    if not is_ollama_config(msd, ums.url):
+        return None
+    warmer = OllamaWarmer(ums.model, ums.url,
+                          keep_alive=config.OLLAMA_KEEP_ALIVE,
+                          ping_interval=config.OLLAMA_PING_INTERVAL,
+                          idle_timeout=config.OLLAMA_IDLE_TIMEOUT,
+                          stats_file=config.LATENCY_FILE)
+    warmer.start()
+    return warmer
+
+
 def main():
     try:
         # 获取选择的文件
         msd = selected_file()
-        # 如果选择的文件不在缓存中，则读取配置文件并创建模型设置
-        if msd not in _MODEL_CACHE:
-            # 读取msd路径下的json配置文件
-            config_data = read_json_config(msd)
-            # 将模型设置缓存到_MODEL_CACHE字典中，键为msd，值为ModelSettings对象，参数为config_data字典中的model、api_key和url
-            _MODEL_CACHE[msd] = ModelSettings(config_data['model'], config_data['api_key'], config_data['url'])
         # 获取模型设置
-        ums = _MODEL_CACHE[msd]
+        ums = load_model_settings(msd)
     except (FileNotFoundError, IndexError, ValueError) as e:
         # 如果发生错误，则打印错误信息并退出程序
         cprint(f"配置加载失败: {e}", 'warning')
         sys.exit(1)
 
+    # 本地Ollama模型：在用户选择预设期间后台预热，避免首轮等待模型加载
+    warmer = start_warmer(msd, ums)
+
     while True:  # 输入验证循环
         try:
             # 获取用户输入的角色编号
@@ -211,7 +364,12 @@ def main():
             preset_name = saved_preset
             conversation_context = saved_context
             cprint("对话已恢复，输入'退出'结束对话",'prompt')
-            modify_json_system_content(config.HISTORY_FILE, file_content)
+            # 用最新提示词替换恢复的系统消息，经 history_writer 原子写回
+            for entry in conversation_context:
+                if entry.get("role") == "system":
+                    entry["content"] = file_content
+                    break
+            save_history(preset_name, conversation_context)
 
         else:
             # 如果用户选择不恢复，则清空历史记录
@@ -230,11 +388,23 @@ def main():
     # 对话循环
     from concurrent.futures import ThreadPoolExecutor
 
-    def process_response(response, preset_name):
+    def process_response(response, preset_name, started, request_warmer=None, was_warm=False):
+        if request_warmer:
+            request_warmer.record_first_reply(time.perf_counter() - started, was_warm)
         ai_response = preprocess_response(response.choices[0].message.content).lstrip()
         conversation_context.append({"role": "assistant", "content": ai_response})
         cprint(f"{preset_name}：{add_newline_after_punctuation(ai_response)}", 'speech')
-        print(get_tokenize(ai_response, config.tknz_path))
+        cprint(token_count_text(ai_response), 'system')
+
+    def on_done(future, started, path, request_warmer, was_warm):
+        # 真实请求结果同样计入路由器的延迟/错误率统计
+        error = future.exception()
+        if router:
+            router.record_request(path, time.perf_counter() - started, error is None)
+        if error is not None:
+            cprint(f"发生错误：{str(error)}", 'warning')
+            return
+        process_response(future.result(), preset_name, started, request_warmer, was_warm)
 
     _lazy_imports()  # 实际需要时加载
     with ThreadPoolExecutor(max_workers=2) as executor:  # 减少初始线程数
@@ -246,23 +416,54 @@ def main():
                 save_choice = input().lower()
                 if save_choice == 'y':
                     save_history(preset_name, conversation_context)
-                    cprint(f"对话已保存到 {config.HISTORY_FILE}",'prompt')
+                    cprint(f"对话已保存到 {config.HISTORY_FILE}（{history_writer.stats_text()}）",'prompt')
                 cprint("对话结束", 'prompt')
+                if warmer:
+                    warmer.stop()
                 break
 
             user_input += get_current_time_info()
-            print(get_tokenize(user_input, config.tknz_path))
+            cprint(token_count_text(user_input), 'system')
             conversation_context.append({"role": "user", "content": user_input})
 
+            # 当前端点劣化时自动切换到同组最快的健康端点
+            if router and not router.is_healthy(msd):
+                fallback = router.fastest(router.group_of(msd), exclude=msd)
+                if fallback:
+                    try:
+                        ums = load_model_settings(fallback)
+                    except (FileNotFoundError, KeyError, ValueError) as e:
+                        cprint(f"切换端点失败: {e}", 'warning')
+                    else:
+                        msd = fallback
+                        use_model = ums.model
+                        client = OpenAI(api_key=ums.apiKey, base_url=ums.url)
+                        cprint(f"当前端点不可用，已切换到 {use_model}", 'system')
+                        if warmer:
+                            warmer.stop()
+                        warmer = start_warmer(msd, ums)
+
+            if warmer:
+                warmer.touch()
+            # 冷/热状态以请求发出时为准，而非回复完成时
+            was_warm = bool(warmer and warmer.warmed.is_set())
+            request_messages = conversation_context
+            if config.PAYLOAD_MINIMIZE:
+                request_messages, saved = minimize_payload(conversation_context, config.PAYLOAD_KEEP_RECENT)
+                if saved['bytes_saved'] > 0:
+                    cprint(f"上下文压缩: 节省 {saved['bytes_saved']} 字节 / 约 {saved['tokens_saved']} tokens", 'system')
+
             try:
+                started = time.perf_counter()
                 future = executor.submit(
                     client.chat.completions.create,
                     model=use_model,
-                    messages=conversation_context,
+                    messages=request_messages,
                     stream=use_stream,
                     temperature=use_temperature
                 )
-                future.add_done_callback(lambda f: process_response(f.result(), preset_name))
+                future.add_done_callback(
+                    lambda f, t=started, p=msd, w=warmer, warm=was_warm: on_done(f, t, p, w, warm))
             except Exception as e:
                 cprint(f"发生错误：{str(e)}", 'warning')
                 conversation_context = conversation_context[-4:]
@@ -319,6 +520,7 @@ def perform_operation():
 def mainloop():
     # 延迟系统检查到实际需要时
     print_welcome()
+    start_router()  # 后台并发探测所有模型端点
     try:
         perform_operation()
     except Exception as e:
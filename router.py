@@ -0,0 +1,206 @@
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import cprint, read_json_config
+
+
+def config_group(file_path: str, config_data: dict) -> str:
+    """
+    推导配置所属分组
+    优先使用配置中的 group 字段，否则按文件名后缀区分 local(by_ollama) 与 api(by_api)
+    """
+    if config_data.get('group'):
+        return config_data['group']
+    name = os.path.basename(file_path).lower()
+    if 'by_ollama' in name:
+        return 'local'
+    if 'by_api' in name:
+        return 'api'
+    return 'default'
+
+
+class EndpointHealth:
+    """单个模型端点的健康状态
+
+    属性:
+        path (str): 配置文件路径
+        model (str): 模型标识名称
+        url (str): 服务端点URL
+        group (str): 所属分组
+        latency (float): 探测延迟EWMA(秒)，尚无成功探测时为None
+        request_latency (float): 真实对话请求耗时EWMA(秒)，尚无成功请求时为None
+        error_rate (float): 错误率EWMA，取值0~1
+        samples (int): 已记录样本数
+    """
+    def __init__(self, path: str, model: str, api_key: str, url: str, group: str):
+        self.path = path
+        self.model = model
+        self.api_key = api_key
+        self.url = url
+        self.group = group
+        self.latency = None
+        self.request_latency = None
+        self.error_rate = 0.0
+        self.samples = 0
+
+    def update(self, seconds: float, ok: bool, alpha: float):
+        """记录一次探测：按EWMA更新探测延迟与错误率"""
+        self.update_error(ok, alpha)
+        if ok:
+            self.latency = seconds if self.latency is None else (1 - alpha) * self.latency + alpha * seconds
+
+    def update_request(self, seconds: float, ok: bool, alpha: float):
+        """记录一次真实请求：计入错误率，耗时单独累计，不影响探测延迟"""
+        self.update_error(ok, alpha)
+        if ok:
+            self.request_latency = (seconds if self.request_latency is None
+                                    else (1 - alpha) * self.request_latency + alpha * seconds)
+
+    def update_error(self, ok: bool, alpha: float):
+        self.samples += 1
+        self.error_rate = (1 - alpha) * self.error_rate + alpha * (0.0 if ok else 1.0)
+
+
+class LatencyRouter:
+    """
+    基于延迟的模型端点路由器
+    功能：
+    - 启动时及之后定期并发探测所有模型配置（GET {url}/models，并校验模型在列表中），全部在后台线程进行
+    - 为每个端点维护探测延迟与错误率的EWMA；真实请求只影响错误率，耗时另行统计
+    - 按分组返回最快的健康端点，当前端点劣化时用于自动切换
+      "最快"：候选端点都有对话耗时样本时按对话耗时，否则按 /models 探测响应耗时；
+      探测只反映连通与排队，不反映生成速度（同一Ollama服务下的多个模型探测耗时几乎相同）
+    使用示例：
+    >>> router = LatencyRouter(search_files('modelSettings'))
+    >>> router.start()
+    >>> router.fastest('local')
+    """
+    def __init__(self, config_files, probe_interval: float = 60.0, alpha: float = 0.3,
+                 error_threshold: float = 0.5, timeout: float = 5.0):
+        self.probe_interval = probe_interval
+        self.alpha = alpha
+        self.error_threshold = error_threshold
+        self.timeout = timeout
+        self.endpoints = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        for path in config_files:
+            if not path.lower().endswith('.json'):
+                continue
+            try:
+                data = read_json_config(path)
+            except (OSError, KeyError, ValueError) as e:
+                cprint(f"跳过无效模型配置 {os.path.basename(path)}: {e}", 'warning')
+                continue
+            self.endpoints[path] = EndpointHealth(path, data['model'], data.get('api_key', ''),
+                                                  data['url'], config_group(path, data))
+
+    @staticmethod
+    def _serves_model(body: bytes, model: str) -> bool:
+        """/models 返回的 data 列表中是否包含所配置的模型（Ollama 省略的 :latest 标签视为相同）"""
+        ids = {item.get('id') for item in json.loads(body.decode('utf-8')).get('data', [])}
+        return model in ids or f"{model}:latest" in ids
+
+    def _probe(self, endpoint: EndpointHealth):
+        """端点可达且返回的模型列表包含所配置模型才算探测成功"""
+        request = urllib.request.Request(
+            endpoint.url.rstrip('/') + '/models',
+            headers={'Authorization': f"Bearer {endpoint.api_key}"},
+        )
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+                body = resp.read()
+            ok = self._serves_model(body, endpoint.model)
+        except (urllib.error.URLError, OSError, ValueError, AttributeError):
+            ok = False
+        self.record(endpoint.path, time.perf_counter() - start, ok)
+
+    def probe_all(self):
+        """并发探测全部端点（阻塞至本轮结束，应在后台线程调用）"""
+        if not self.endpoints:
+            return
+        with ThreadPoolExecutor(max_workers=len(self.endpoints)) as pool:
+            list(pool.map(self._probe, list(self.endpoints.values())))
+
+    def _run(self):
+        self.probe_all()
+        while not self._stop.wait(self.probe_interval):
+            self.probe_all()
+
+    def start(self):
+        """启动后台探测线程，立即返回"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def record(self, path: str, seconds: float, ok: bool):
+        """记录一次探测的结果"""
+        with self._lock:
+            endpoint = self.endpoints.get(path)
+            if endpoint:
+                endpoint.update(seconds, ok, self.alpha)
+
+    def record_request(self, path: str, seconds: float, ok: bool):
+        """记录一次真实对话请求的结果（完整回复耗时与探测延迟量级不同，单独累计）"""
+        with self._lock:
+            endpoint = self.endpoints.get(path)
+            if endpoint:
+                endpoint.update_request(seconds, ok, self.alpha)
+
+    def is_healthy(self, path: str) -> bool:
+        """端点是否健康；尚未探测过的端点视为健康，避免启动阶段误切换"""
+        with self._lock:
+            endpoint = self.endpoints.get(path)
+            if endpoint is None or endpoint.samples == 0:
+                return True
+            return endpoint.latency is not None and endpoint.error_rate < self.error_threshold
+
+    def group_of(self, path: str) -> str:
+        endpoint = self.endpoints.get(path)
+        return endpoint.group if endpoint else None
+
+    def fastest(self, group: str = None, exclude: str = None) -> str:
+        """
+        返回指定分组中最快的健康端点配置路径
+        候选端点都有对话耗时样本时按对话耗时排序；否则按探测响应耗时排序，
+        此时结果只代表"最快响应探测"，不代表生成最快
+        :param group: 分组名，None表示不限分组
+        :param exclude: 排除的配置路径（通常是刚劣化的当前端点）
+        :return: 配置文件路径，无可用端点时返回None
+        """
+        with self._lock:
+            candidates = [e for e in self.endpoints.values()
+                          if (group is None or e.group == group)
+                          and e.path != exclude
+                          and e.latency is not None
+                          and e.error_rate < self.error_threshold]
+        if not candidates:
+            return None
+        # 两种耗时量级不同，不能混合比较：只有全部候选都有对话耗时时才使用
+        if all(e.request_latency is not None for e in candidates):
+            return min(candidates, key=lambda e: e.request_latency).path
+        return min(candidates, key=lambda e: e.latency).path
+
+    def summary(self) -> str:
+        """生成各端点状态的文本摘要"""
+        with self._lock:
+            rows = [
+                f"{e.model:25} [{e.group}] "
+                + (f"{e.latency * 1000:.0f}ms" if e.latency is not None else "未知")
+                + (f" 请求{e.request_latency:.1f}s" if e.request_latency is not None else "")
+                + f" 错误率{e.error_rate:.0%}"
+                for e in self.endpoints.values()
+            ]
+        return '\n'.join(rows)
@@ -0,0 +1,76 @@
+import copy
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import minimize_payload
+
+TS1 = '[2025-03-21 22:59:45 星期五]'
+TS2 = '[2025-03-21 23:01:57 星期五]'
+TS3 = '[2025-03-22 10:22:21 星期六]'
+
+
+def _contents(messages):
+    return [m['content'] for m in messages]
+
+
+def test_user_literal_think_tag_keeps_text():
+    messages = [
+        {'role': 'user', 'content': 'how do I write <think> tags in html?' + TS1},
+        {'role': 'user', 'content': 'a </think> b' + TS3},
+        {'role': 'user', 'content': 'latest'},
+    ]
+    minimized, _ = minimize_payload(messages, keep_recent=1)
+    assert _contents(minimized)[:2] == [
+        'how do I write <think> tags in html?[2025-03-21]',
+        'a </think> b[2025-03-22]',
+    ]
+
+
+def test_leading_think_remnant_stripped_only_from_assistant():
+    messages = [
+        {'role': 'assistant', 'content': '推理过程</think>\n\n你好呀'},
+        {'role': 'assistant', 'content': '前<think>想一想</think>后 <think> 字面量'},
+        {'role': 'user', 'content': '推理过程</think>保留'},
+        {'role': 'user', 'content': 'latest'},
+    ]
+    minimized, saved = minimize_payload(messages, keep_recent=1)
+    assert _contents(minimized)[:3] == ['你好呀', '前后 <think> 字面量', '推理过程</think>保留']
+    assert saved['bytes_saved'] > 0 and saved['tokens_saved'] > 0
+
+
+def test_one_date_marker_per_day():
+    messages = [
+        {'role': 'user', 'content': '在干啥' + TS1},
+        {'role': 'user', 'content': '好诶！' + TS2},
+        {'role': 'user', 'content': '在干嘛？' + TS3},
+        {'role': 'user', 'content': 'latest'},
+    ]
+    minimized, _ = minimize_payload(messages, keep_recent=1)
+    assert _contents(minimized)[:3] == ['在干啥[2025-03-21]', '好诶！', '在干嘛？[2025-03-22]']
+
+
+def test_system_and_recent_messages_unchanged():
+    system = {'role': 'system', 'content': '提示词  \n\n\n保持原样' + TS1}
+    recent = [
+        {'role': 'assistant', 'content': '思考</think>  回复'},
+        {'role': 'user', 'content': '最新消息   ' + TS3},
+    ]
+    messages = [system, {'role': 'user', 'content': '旧消息' + TS1}] + recent
+    minimized, _ = minimize_payload(messages, keep_recent=2)
+    assert minimized[0] == system
+    assert minimized[-2:] == recent
+
+
+def test_input_list_not_modified():
+    messages = [
+        {'role': 'system', 'content': 'sys'},
+        {'role': 'assistant', 'content': '推理</think>回复   内容'},
+        {'role': 'user', 'content': '旧消息' + TS1},
+        {'role': 'user', 'content': 'latest'},
+    ]
+    original = copy.deepcopy(messages)
+    minimized, _ = minimize_payload(messages, keep_recent=1)
+    assert messages == original
+    assert minimized is not messages
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+import textwrap
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tknz import token_estimator
+
+# README 中对外声明的误差上界；重新校准后误差变大时此处应当失败，而不是随校准文件一起放宽
+STATED_MAX_RELATIVE_ERROR = 0.35
+
+
+def _max_error(pairs):
+    errors = [abs(token_estimator.estimate_tokens(text) - exact) / exact
+              for text, exact in pairs if exact >= token_estimator.MIN_VALIDATE_TOKENS]
+    assert errors
+    return max(errors)
+
+
+def test_estimate_within_stated_bound_on_holdout():
+    # 留出集不参与拟合，验证的是泛化误差而非拟合残差
+    holdout = token_estimator.calibration_pairs(holdout=True)
+    assert len(holdout) >= 10
+    assert _max_error(holdout) <= STATED_MAX_RELATIVE_ERROR
+
+
+def test_estimate_within_stated_bound_on_fit_set():
+    assert _max_error(token_estimator.calibration_pairs()) <= STATED_MAX_RELATIVE_ERROR
+    assert token_estimator.error_bound() <= STATED_MAX_RELATIVE_ERROR
+
+
+def test_default_token_count_does_not_import_transformers(tmp_path):
+    script = textwrap.dedent("""
+        import sys
+
+        class BlockTransformers:
+            def find_spec(self, name, path=None, target=None):
+                if name == 'transformers' or name.startswith('transformers.'):
+                    raise ImportError('transformers is blocked in this test')
+                return None
+
+        sys.meta_path.insert(0, BlockTransformers())
+        import utils, main
+
+        text = main.token_count_text('你好呀！Hello world 2025')
+        assert text.startswith('≈') and text.endswith(' tokens'), text
+
+        # 确认拦截生效：exact 模式必须触发 transformers 导入
+        main.config.TOKEN_COUNT_MODE = 'exact'
+        try:
+            main.token_count_text('hi')
+        except ImportError:
+            pass
+        else:
+            raise AssertionError('exact mode did not import transformers')
+    """)
+    env = dict(os.environ, ASSISTANT_CONFIG=str(tmp_path))
+    result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+
+
+def test_estimate_runs_in_microseconds():
+    text = "你好呀！认识一下，我是冬止无。Hello world, this is a test." * 3
+    start = time.perf_counter()
+    for _ in range(1000):
+        token_estimator.estimate_tokens(text)
+    assert (time.perf_counter() - start) / 1000 < 1e-3
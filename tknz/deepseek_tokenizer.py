@@ -1,15 +1,25 @@
 # pip3 install transformers
 # python3 deepseek_tokenizer.py
+from functools import lru_cache
+
 import transformers
 
 
-def get_tokenize(thestr, path):
-    chat_tokenizer_dir = path + "/"
+@lru_cache(maxsize=None)
+def _load_tokenizer(path):
+    return transformers.AutoTokenizer.from_pretrained(path + "/", trust_remote_code=True)
+
 
-    tokenizer = transformers.AutoTokenizer.from_pretrained(chat_tokenizer_dir, trust_remote_code=True)
+def get_tokenize(thestr, path):
+    tokenizer = _load_tokenizer(path)
     result = tokenizer.encode(thestr)
     print(result)
 
 
+def count_tokens(thestr, path):
+    """使用真实分词器精确计数（首次调用会加载分词器）"""
+    return len(_load_tokenizer(path).encode(thestr))
+
+
 if __name__ == "__main__":
     get_tokenize("Hell", "./")
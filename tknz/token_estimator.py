@@ -0,0 +1,195 @@
+# 轻量token估算器：不依赖transformers，用于实时显示与上下文预算
+# 校准: python3 tknz/token_estimator.py calibrate   (需要transformers与完整分词器文件)
+# 验证: python3 tknz/token_estimator.py validate    (无分词器时仅用校准文件中的样本验证)
+import json
+import math
+import os
+import re
+
+CALIBRATION_FILE = os.path.join(os.path.dirname(__file__), 'estimator_calibration.json')
+
+# 校准文件缺失时的兜底系数，取自DeepSeek官方换算：1个中文字符≈0.6 token，1个英文字符≈0.3 token
+# 未经校准，不声明误差上界
+DEFAULT_CALIBRATION = {
+    "coefficients": {"cjk": 0.6, "ascii": 0.3, "digit": 1.0, "punct": 0.5, "space": 0.0, "other": 1.0},
+    "max_relative_error": None,
+    "samples": 0,
+    "pairs": [],
+    "holdout": [],
+}
+
+# 过短文本的相对误差没有参考意义，验证时只统计不少于该token数的样本
+MIN_VALIDATE_TOKENS = 10
+# 校准时每 HOLDOUT_EVERY 条语料留出一条，不参与拟合，仅用于验证
+HOLDOUT_EVERY = 4
+
+_CJK_PATTERN = re.compile(r'[㐀-䶿一-鿿豈-﫿぀-ヿ가-힯]')
+_ASCII_PUNCT_PATTERN = re.compile(r'[!-/:-@\[-`{-~]')
+_DIGIT_PATTERN = re.compile(r'[0-9]')
+_ASCII_SPACE_PATTERN = re.compile(r'[ \t\r\n]')
+
+_calibration = None
+
+
+def load_calibration() -> dict:
+    """读取校准数据（仅首次读取文件），缺失或损坏时使用默认系数"""
+    global _calibration
+    if _calibration is None:
+        try:
+            with open(CALIBRATION_FILE, 'r', encoding='utf-8') as f:
+                _calibration = json.load(f)
+        except (OSError, ValueError):
+            _calibration = DEFAULT_CALIBRATION
+    return _calibration
+
+
+def char_features(text: str) -> dict:
+    """按字符类别计数：CJK、ASCII字母、数字（逐位成token）、ASCII标点、ASCII空白、其他（全角标点、emoji等）"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    punct = len(_ASCII_PUNCT_PATTERN.findall(text))
+    ascii_total = len(text.encode('ascii', 'ignore'))
+    digit = len(_DIGIT_PATTERN.findall(text))
+    space = len(_ASCII_SPACE_PATTERN.findall(text))
+    return {
+        "cjk": cjk,
+        "ascii": ascii_total - digit - punct - space,
+        "digit": digit,
+        "punct": punct,
+        "space": space,
+        "other": len(text) - cjk - ascii_total,
+    }
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数（微秒级，不加载分词器）
+    误差上界见 error_bound()，仅对不少于 MIN_VALIDATE_TOKENS 的文本有效
+    """
+    if not text:
+        return 0
+    coefficients = load_calibration()['coefficients']
+    features = char_features(text)
+    return max(1, round(sum(coefficients[k] * v for k, v in features.items())))
+
+
+def error_bound() -> float:
+    """全部校准语料（拟合集与留出集）上实测的最大相对误差；未校准时返回None"""
+    return load_calibration()['max_relative_error']
+
+
+def calibration_pairs(holdout: bool = False) -> list:
+    """
+    校准文件中记录的 (文本, 精确token数) 样本
+    :param holdout: True 返回未参与拟合的留出集，False 返回拟合集
+    """
+    return [tuple(pair) for pair in load_calibration().get('holdout' if holdout else 'pairs', [])]
+
+
+def load_corpus() -> list:
+    """收集校准语料：对话历史、提示词、聊天记录与README"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    texts = []
+    history = os.path.join(root, '.assistant_config', 'conversation_history.json')
+    if os.path.exists(history):
+        with open(history, 'r', encoding='utf-8') as f:
+            texts.extend(m['content'] for m in json.load(f).get('history', []) if m.get('content'))
+    for name in (os.path.join('tools', 'prompt.txt'), '记录.txt', 'README.md'):
+        path = os.path.join(root, name)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                texts.extend(p for p in f.read().split('\n\n') if p.strip())
+    return texts
+
+
+def _fit(rows: list, targets: list, keys: list) -> dict:
+    """
+    加权最小二乘拟合各类字符的系数（正规方程 + 高斯消元）
+    权重为 1/精确值²，即最小化相对误差，避免长文本主导拟合
+    """
+    n = len(keys)
+    weights = [1.0 / (t * t) if t else 0.0 for t in targets]
+    a = [[sum(w * r[i] * r[j] for r, w in zip(rows, weights)) for j in range(n)] for i in range(n)]
+    b = [sum(w * r[i] * t for r, t, w in zip(rows, targets, weights)) for i in range(n)]
+    for i in range(n):
+        a[i][i] += 1e-6  # 防止某类字符在语料中缺失导致矩阵奇异
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+        a[col], a[pivot] = a[pivot], a[col]
+        b[col], b[pivot] = b[pivot], b[col]
+        for r in range(col + 1, n):
+            factor = a[r][col] / a[col][col]
+            for c in range(col, n):
+                a[r][c] -= factor * a[col][c]
+            b[r] -= factor * b[col]
+    x = [0.0] * n
+    for i in reversed(range(n)):
+        x[i] = (b[i] - sum(a[i][j] * x[j] for j in range(i + 1, n))) / a[i][i]
+    return {k: round(max(v, 0.0), 4) for k, v in zip(keys, x)}
+
+
+def validate(texts: list, exact_counts: list, calibration: dict = None, mean: bool = False) -> float:
+    """返回语料上估算值相对精确值的最大（mean=True 时为平均）相对误差，忽略少于 MIN_VALIDATE_TOKENS 的样本"""
+    global _calibration
+    previous = _calibration
+    if calibration is not None:
+        _calibration = calibration
+    try:
+        errors = [abs(estimate_tokens(t) - c) / c for t, c in zip(texts, exact_counts)
+                  if c >= MIN_VALIDATE_TOKENS]
+        if mean:
+            return sum(errors) / len(errors) if errors else 0.0
+        return max(errors, default=0.0)
+    finally:
+        _calibration = previous
+
+
+def calibrate(count) -> dict:
+    """
+    用真实分词器在语料上拟合系数，并把系数、实测误差上界与样本一起写入校准文件
+    :param count: 精确计数函数 text -> int
+    """
+    texts = load_corpus()
+    exact = [count(t) for t in texts]
+    pairs = [[t, c] for i, (t, c) in enumerate(zip(texts, exact)) if i % HOLDOUT_EVERY != HOLDOUT_EVERY - 1]
+    holdout = [[t, c] for i, (t, c) in enumerate(zip(texts, exact)) if i % HOLDOUT_EVERY == HOLDOUT_EVERY - 1]
+    keys = list(DEFAULT_CALIBRATION['coefficients'])
+    rows = [[char_features(t)[k] for k in keys] for t, _ in pairs]
+    calibration = {"coefficients": _fit(rows, [c for _, c in pairs], keys), "samples": len(texts)}
+    # 上界向上取整，避免四舍五入后略小于实测最大误差
+    calibration['max_relative_error'] = math.ceil(validate(texts, exact, calibration) * 1e4) / 1e4
+    calibration['mean_relative_error'] = round(validate(texts, exact, calibration, mean=True), 4)
+    calibration['holdout_max_relative_error'] = round(
+        validate([t for t, _ in holdout], [c for _, c in holdout], calibration), 4)
+    calibration['pairs'] = pairs
+    calibration['holdout'] = holdout
+    with open(CALIBRATION_FILE, 'w', encoding='utf-8') as f:
+        json.dump(calibration, f, ensure_ascii=False, indent=2)
+    return calibration
+
+
+if __name__ == "__main__":
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    command = sys.argv[1] if len(sys.argv) > 1 else 'validate'
+    path = os.path.dirname(os.path.abspath(__file__))
+    if command == 'calibrate':
+        from tknz.deepseek_tokenizer import count_tokens
+        result = calibrate(lambda text: count_tokens(text, path))
+        print(f"样本数: {result['samples']}  系数: {result['coefficients']}  "
+              f"最大误差: {result['max_relative_error']:.2%}  "
+              f"留出集最大误差: {result['holdout_max_relative_error']:.2%}")
+        sys.exit(0)
+    if error_bound() is None:
+        print("尚未校准，没有可验证的误差上界")
+        sys.exit(1)
+    try:
+        from tknz.deepseek_tokenizer import count_tokens
+        corpus = load_corpus()
+        exact = [count_tokens(text, path) for text in corpus]
+    except (ImportError, OSError, ValueError) as e:
+        print(f"无法加载真实分词器（{e}），改用校准文件中的样本验证")
+        stored = calibration_pairs() + calibration_pairs(holdout=True)
+        corpus, exact = zip(*stored) if stored else ((), ())
+    worst = validate(list(corpus), list(exact))
+    print(f"样本数: {len(corpus)}  最大相对误差: {worst:.2%}  声明上界: {error_bound():.2%}")
+    sys.exit(0 if worst <= error_bound() else 1)
@@ -4,6 +4,8 @@ import json
 import re
 from typing import List
 
+from tknz.token_estimator import estimate_tokens
+
 def replace_consecutive_newlines(input_string):
     pattern = r'\n{2,}'
     return re.sub(pattern, '\n', input_string)
@@ -35,6 +37,48 @@ def preprocess_response(response):
     return replace_consecutive_newlines(extract_content_after_think(response)).lstrip()
 
 
+# 完整的 <think>…</think> 块，或消息开头缺少 <think> 的推理残留（截至首个 </think>）
+_THINK_BLOCK_PATTERN = re.compile(r'<think>.*?</think>', re.S)
+_LEADING_THINK_PATTERN = re.compile(r'^(?:(?!<think>).)*?</think>', re.S)
+_TIME_SUFFIX_PATTERN = re.compile(r'\[(\d{4}-\d{2}-\d{2}) \d{2}:\d{2}:\d{2} 星期.\]\s*$')
+_INLINE_SPACE_PATTERN = re.compile(r'[ \t　]{2,}')
+
+
+def minimize_payload(messages: List[dict], keep_recent: int = 4) -> tuple:
+    """
+    请求前压缩上下文，只保留最近 keep_recent 条消息原样发送
+    较早的消息：
+    1. assistant 消息去除 <think> 推理残留（仅完整块或开头残留）
+    2. 时间戳后缀折叠为日期标记，同一天只保留第一次
+    3. 合并重复空白与连续换行
+    system 消息始终原样保留；不修改传入的列表
+    :return: (压缩后的消息列表, {'bytes_saved': int, 'tokens_saved': int})
+    """
+    cutoff = max(len(messages) - keep_recent, 0)
+    minimized = []
+    saved_bytes = saved_tokens = 0
+    last_date = None
+    for i, msg in enumerate(messages):
+        content = msg.get('content') or ''
+        if i >= cutoff or msg.get('role') == 'system':
+            minimized.append(msg)
+            continue
+        text = content
+        if msg.get('role') == 'assistant':
+            text = _THINK_BLOCK_PATTERN.sub('', _LEADING_THINK_PATTERN.sub('', text, count=1))
+        match = _TIME_SUFFIX_PATTERN.search(text)
+        if match:
+            date = match.group(1)
+            marker = f"[{date}]" if date != last_date else ''
+            text = text[:match.start()] + marker
+            last_date = date
+        text = replace_consecutive_newlines(_INLINE_SPACE_PATTERN.sub(' ', text)).strip()
+        saved_bytes += len(content.encode('utf-8')) - len(text.encode('utf-8'))
+        saved_tokens += estimate_tokens(content) - estimate_tokens(text)
+        minimized.append({**msg, 'content': text})
+    return minimized, {'bytes_saved': saved_bytes, 'tokens_saved': saved_tokens}
+
+
 def q_input(prompt: str) -> str:
     """带退出检测的输入函数"""
     # 输入提示信息
@@ -191,11 +235,15 @@ def get_json_value(file_path, key):
         return None
 
 
-def ask_user_choice(file_list):
+AUTO_CHOICE = 'auto'
+
+
+def ask_user_choice(file_list, allow_auto: bool = False):
     """
     询问用户选择使用哪个文件
     :param file_list: 可读取文件的列表
-    :return: 用户选择的文件路径
+    :param allow_auto: 是否提供"0. 自动选择"选项
+    :return: 用户选择的文件路径；选择自动时返回 AUTO_CHOICE
     """
     # 过滤并增强JSON文件显示
     json_files = [f for f in file_list if f.lower().endswith('.json')]
@@ -209,11 +257,15 @@ def ask_user_choice(file_list):
         model_name = get_json_value(file_path, 'model') or '未命名模型'
         file_name = os.path.basename(file_path)
         cprint(f"{i}. {model_name:25} ▶ {file_name}", 'system')
+    if allow_auto:
+        cprint(f"0. {'自动选择健康模型（按对话耗时，无样本时按探测响应耗时）':25}", 'system')
     while True:
         try:
             choice = int(q_input("请输入要使用的文件编号: "))
-            if 1 <= choice <= len(file_list):
-                return file_list[choice - 1]
+            if allow_auto and choice == 0:
+                return AUTO_CHOICE
+            if 1 <= choice <= len(json_files):
+                return json_files[choice - 1]
             else:
                 cprint("输入的编号无效，请重新输入。", 'warning')
         except ValueError:
@@ -0,0 +1,167 @@
+import datetime
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urlsplit
+
+from utils import cprint
+
+
+def is_ollama_config(file_path: str, url: str) -> bool:
+    """判断配置是否指向本地 Ollama 服务
+
+    依据文件名中的 ``by_ollama`` 标记或默认端口 11434 判断。
+    """
+    name = os.path.basename(file_path or '').lower()
+    return 'by_ollama' in name or ':11434' in (url or '')
+
+
+def ollama_native_base(url: str) -> str:
+    """由 OpenAI 兼容端点(如 http://localhost:11434/v1/)推导 Ollama 原生 API 根地址"""
+    if '://' not in url:
+        url = 'http://' + url
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class OllamaWarmer:
+    """
+    本地 Ollama 模型预热与保活管理器
+    功能：
+    - 选定配置后在后台发送空提示请求，提前把模型加载进内存
+    - 会话活跃期间定时发送保活请求，让模型常驻
+    - 会话空闲超过 idle_timeout 后停止保活，由 Ollama 按 keep_alive 自动卸载
+    - 记录冷启动加载耗时与首条回复耗时，便于调参
+    使用示例：
+    >>> warmer = OllamaWarmer('qwen2.5-14b', 'http://localhost:11434/v1/')
+    >>> warmer.start()
+    >>> warmer.touch()            # 每轮对话时调用，标记会话活跃
+    >>> warmer.record_first_reply(3.2, warm=True)
+    >>> warmer.stop()
+    """
+    # /api/ps 不可用时，预热请求耗时超过该秒数才视为实际加载了模型
+    COLD_LOAD_SECONDS = 1.0
+
+    def __init__(self, model: str, url: str, keep_alive: str = '5m',
+                 ping_interval: float = 120.0, idle_timeout: float = 600.0,
+                 stats_file: str = None, timeout: float = 120.0):
+        self.model = model
+        self.base_url = ollama_native_base(url)
+        self.keep_alive = keep_alive
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.stats_file = stats_file
+        self.timeout = timeout
+        # 预热完成事件，调用方在发出请求时读取，据此判断冷/热启动
+        self.warmed = threading.Event()
+        self.warmup_seconds = None
+        self._first_reply_recorded = False
+        # 预热失败（如Ollama未运行）后不再随每轮对话重试，直到下一次 start()
+        self._failed = False
+        self._last_active = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _is_resident(self) -> bool:
+        """通过 /api/ps 查询模型是否已常驻内存；接口不可用时返回None"""
+        try:
+            with urllib.request.urlopen(f"{self.base_url}/api/ps", timeout=self.timeout) as resp:
+                models = json.loads(resp.read().decode('utf-8')).get('models', [])
+        except (urllib.error.URLError, OSError, ValueError):
+            return None
+        names = {m.get('name') for m in models} | {m.get('model') for m in models}
+        return self.model in names or f"{self.model}:latest" in names
+
+    def _ping(self) -> float:
+        """发送不含 prompt 的 generate 请求，仅加载模型并刷新 keep_alive，返回耗时(秒)"""
+        payload = json.dumps({"model": self.model, "keep_alive": self.keep_alive}).encode('utf-8')
+        request = urllib.request.Request(
+            f"{self.base_url}/api/generate",
+            data=payload,
+            headers={'Content-Type': 'application/json'},
+        )
+        start = time.perf_counter()
+        with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+            resp.read()
+        return time.perf_counter() - start
+
+    def _run(self):
+        try:
+            resident = self._is_resident()
+            self.warmup_seconds = self._ping()
+            self.warmed.set()
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            self._failed = True
+            cprint(f"模型预热失败: {e}", 'warning')
+            return
+        # 仅当模型确实被加载时记为冷启动；/api/ps 不可用时依据预热请求耗时判断
+        # （仅加载的 generate 请求返回 done_reason=load，不含 load_duration）
+        if resident is not None:
+            loaded = not resident
+        else:
+            loaded = self.warmup_seconds >= self.COLD_LOAD_SECONDS
+        self._record('cold_load' if loaded else 'warm_ping', self.warmup_seconds, warm=not loaded)
+        # 保活循环：会话空闲超时后退出，让模型按 keep_alive 自然卸载
+        while not self._stop.wait(self.ping_interval):
+            if time.monotonic() - self._last_active > self.idle_timeout:
+                break
+            try:
+                self._ping()
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                cprint(f"模型保活失败: {e}", 'warning')
+
+    def start(self):
+        """在后台线程中启动预热与保活，不阻塞交互；会清除之前的预热失败状态"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._failed = False
+        # 每次（重新）预热都视为新的一轮：首条回复重新记录，预热完成前按冷启动计
+        self._first_reply_recorded = False
+        self.warmed.clear()
+        self._stop.clear()
+        self._last_active = time.monotonic()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def touch(self):
+        """标记会话活跃；若保活线程已因空闲退出则重新启动（预热失败后不重试）"""
+        self._last_active = time.monotonic()
+        if self._failed:
+            return
+        if not (self._thread and self._thread.is_alive()):
+            self.start()
+
+    def stop(self):
+        """停止保活，模型将在 keep_alive 到期后卸载"""
+        self._stop.set()
+
+    def record_first_reply(self, seconds: float, warm: bool):
+        """
+        记录本轮预热后首条回复耗时
+        :param warm: 请求发出时模型是否已预热完成（应在提交请求时读取 warmed）
+        """
+        if self._first_reply_recorded:
+            return
+        self._first_reply_recorded = True
+        self._record('first_reply', seconds, warm=warm)
+
+    def _record(self, kind: str, seconds: float, warm: bool):
+        if not self.stats_file:
+            return
+        entry = {
+            "time": f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S}",
+            "model": self.model,
+            "kind": kind,
+            "warm": warm,
+            "seconds": round(seconds, 3),
+            "keep_alive": self.keep_alive,
+        }
+        try:
+            os.makedirs(os.path.dirname(self.stats_file) or '.', exist_ok=True)
+            with open(self.stats_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        except OSError as e:
+            cprint(f"写入延迟统计失败: {e}", 'warning')